@@ -0,0 +1,338 @@
+"""
+Batch renderer for printable patient reports
+Turns generate_comprehensive_health_report output into HTML and PDF files in bulk
+
+Usage:
+    python batch_report_renderer.py reports.jsonl out/ --formats html pdf --workers 8
+    python batch_report_renderer.py reports_dir/ out/
+
+Input is either a JSONL file of {"id": ..., "medical_text": ...} records or a
+directory of .txt reports (file name is used as the report id). Finished files
+are written to the output directory as they complete and recorded one line at a
+time in manifest.jsonl.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from jinja2 import Environment
+
+try:
+    import pymupdf
+except ImportError:  # Older PyMuPDF releases only ship the fitz module
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+from medical_report_simplifier import (
+    extract_medical_values_comprehensive,
+    generate_comprehensive_health_report
+)
+
+SUPPORTED_FORMATS = ("html", "pdf")
+MANIFEST_NAME = "manifest.jsonl"
+
+# PRINTABLE REPORT TEMPLATE - Kept to plain HTML/CSS so the PDF engine can lay it out
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Health Report {{ report_id }}</title>
+<style>
+body { font-family: sans-serif; font-size: 11pt; color: #222; }
+h1 { font-size: 18pt; margin-bottom: 2pt; }
+h2 { font-size: 14pt; margin-top: 14pt; border-bottom: 1px solid #999; }
+h3 { font-size: 12pt; margin-bottom: 2pt; }
+.meta { color: #666; font-size: 9pt; }
+.status-low, .status-high { color: #b00020; font-weight: bold; }
+.status-normal { color: #2e7d32; font-weight: bold; }
+td, th { padding: 3pt 6pt; text-align: left; }
+</style>
+</head>
+<body>
+<h1>Your Health Report</h1>
+<p class="meta">Report {{ report_id }} | Generated {{ generated }}</p>
+{% if report.message %}
+<p>{{ report.message }}</p>
+<p>{{ report.suggestion }}</p>
+{% else %}
+<p><b>Health Score: {{ report.health_score }}/100</b></p>
+<p>{{ report.summary }}</p>
+
+<h2>Test Results</h2>
+<table>
+<tr><th>Test</th><th>Value</th><th>Normal Range</th><th>Status</th></tr>
+{% for test in report.individual_tests %}
+<tr>
+<td>{{ test.test_name }}</td>
+<td>{{ test.value }} {{ test.unit }}</td>
+<td>{{ test.reference_range }}</td>
+<td class="status-{{ test.status|lower }}">{{ test.status }}</td>
+</tr>
+{% endfor %}
+</table>
+
+{% for test in report.individual_tests %}
+<h3>{{ test.test_name }}</h3>
+<p>{{ test.simple_explanation.what_it_is }}</p>
+<p>{{ test.interpretation }}</p>
+{% endfor %}
+
+{% if report.health_conditions %}
+<h2>Possible Health Conditions</h2>
+{% for condition in report.health_conditions %}
+<h3>{{ condition.name }} ({{ condition.confidence }} confidence)</h3>
+<p>{{ condition.description }}</p>
+<p><b>When to see a doctor:</b> {{ condition.when_to_see_doctor }}</p>
+{% endfor %}
+{% endif %}
+
+{% if report.organ_analysis %}
+<h2>Organ Systems</h2>
+<ul>
+{% for organ in report.organ_analysis.values() %}
+<li><b>{{ organ.info.name }}</b>: {{ organ.status }}</li>
+{% endfor %}
+</ul>
+{% endif %}
+
+<h2>Recommendations</h2>
+{% for title, key in [("Foods to eat", "foods_to_eat"), ("Foods to avoid", "foods_to_avoid"), ("Lifestyle", "lifestyle"), ("Activities", "activities")] %}
+{% if report.overall_recommendations[key] %}
+<h3>{{ title }}</h3>
+<ul>
+{% for item in report.overall_recommendations[key] %}<li>{{ item }}</li>{% endfor %}
+</ul>
+{% endif %}
+{% endfor %}
+{% endif %}
+<p class="meta">This summary is for education only and does not replace advice from your doctor.</p>
+</body>
+</html>
+"""
+
+# Compiled once per worker process by _init_worker
+_COMPILED_TEMPLATE = None
+
+def compile_report_template():
+    """Compile the printable report template"""
+    return Environment(autoescape=True).from_string(REPORT_TEMPLATE)
+
+def _init_worker():
+    global _COMPILED_TEMPLATE
+    _COMPILED_TEMPLATE = compile_report_template()
+
+def render_report_html(report, report_id, template=None):
+    """Render a comprehensive health report dict to a standalone HTML page"""
+    template = template or _COMPILED_TEMPLATE or compile_report_template()
+    return template.render(
+        report=report,
+        report_id=report_id,
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M")
+    )
+
+def render_report_pdf(html, path):
+    """Lay out rendered report HTML onto A4 pages with PyMuPDF"""
+    if pymupdf is None:
+        raise RuntimeError("PDF output needs PyMuPDF - install it with 'pip install PyMuPDF'")
+
+    story = pymupdf.Story(html=html)
+    writer = pymupdf.DocumentWriter(path)
+    mediabox = pymupdf.paper_rect("a4")
+    content_area = mediabox + (36, 36, -36, -36)
+
+    more = True
+    while more:
+        device = writer.begin_page(mediabox)
+        more, _ = story.place(content_area)
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+
+def safe_report_filename(report_id):
+    """
+    Turn a report id into a file-system safe, unique base name
+    A short hash of the raw id keeps ids such as "a/b" and "a_b" apart
+    """
+    readable = re.sub(r'[^A-Za-z0-9._-]+', '_', str(report_id)).strip('._')[:80] or "report"
+    digest = hashlib.sha256(str(report_id).encode("utf-8")).hexdigest()[:10]
+    return f"{readable}-{digest}"
+
+def _write_atomically(path, write):
+    tmp_path = f"{path}.part"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Never leave half-written files behind in the output directory
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def render_one_report(report_id, medical_text, output_dir, formats):
+    """
+    Analyse one report and write it in every requested format
+    Returns the manifest entry for the report
+    """
+    started = time.perf_counter()
+    entry = {"id": report_id, "files": {}, "success": True}
+
+    try:
+        extracted_data = extract_medical_values_comprehensive(medical_text)
+        report = generate_comprehensive_health_report(extracted_data)
+        html = render_report_html(report, report_id)
+        base_path = os.path.join(output_dir, safe_report_filename(report_id))
+
+        if "html" in formats:
+            html_path = f"{base_path}.html"
+
+            def write_html(path):
+                with open(path, "w", encoding="utf-8") as html_file:
+                    html_file.write(html)
+
+            _write_atomically(html_path, write_html)
+            entry["files"]["html"] = os.path.basename(html_path)
+
+        if "pdf" in formats:
+            pdf_path = f"{base_path}.pdf"
+            _write_atomically(pdf_path, lambda path: render_report_pdf(html, path))
+            entry["files"]["pdf"] = os.path.basename(pdf_path)
+
+        entry["health_score"] = report.get("health_score", 0)
+        entry["total_tests"] = report.get("total_tests", 0)
+    except Exception as e:
+        entry["success"] = False
+        entry["error"] = str(e)
+
+    entry["render_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return entry
+
+def iter_report_inputs(input_path):
+    """
+    Yield (report_id, medical_text, error) triples from a JSONL file or a directory of .txt files
+    An input that cannot be read yields its error instead of text so one bad line never ends the batch
+    """
+    if os.path.isdir(input_path):
+        for file_name in sorted(os.listdir(input_path)):
+            if file_name.lower().endswith(".txt"):
+                report_id = os.path.splitext(file_name)[0]
+                try:
+                    with open(os.path.join(input_path, file_name), encoding="utf-8") as report_file:
+                        yield report_id, report_file.read(), None
+                except (OSError, UnicodeDecodeError) as e:
+                    yield report_id, None, f"Unreadable report file: {str(e)}"
+        return
+
+    with open(input_path, encoding="utf-8", errors="replace") as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, start=1):
+            if not line.strip():
+                continue
+            default_id = f"report-{line_number}"
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield default_id, None, f"Line {line_number} is not valid JSON: {str(e)}"
+                continue
+            if not isinstance(record, dict):
+                yield default_id, None, f"Line {line_number} is not a JSON object"
+                continue
+
+            report_id = record.get("id", default_id)
+            medical_text = record.get("medical_text")
+            if not isinstance(medical_text, str):
+                yield report_id, None, f"Line {line_number} has no medical_text string"
+                continue
+            yield report_id, medical_text, None
+
+def render_batch(input_path, output_dir, formats=SUPPORTED_FORMATS, workers=None, max_pending=None):
+    """
+    Render every input report across a process pool
+    Finished files are streamed to output_dir and appended to the manifest as they complete
+    Returns a summary dict
+    """
+    formats = tuple(formats)
+    unknown = set(formats) - set(SUPPORTED_FORMATS)
+    if unknown:
+        raise ValueError(f"Unsupported formats: {', '.join(sorted(unknown))}")
+    if "pdf" in formats and pymupdf is None:
+        raise RuntimeError("PDF output needs PyMuPDF - install it with 'pip install PyMuPDF'")
+
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # Bound in-flight work so huge inputs are never fully loaded into memory
+    max_pending = max_pending or workers * 4
+
+    summary = {"rendered": 0, "failed": 0}
+    started = time.perf_counter()
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+
+        def write_entry(entry):
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            summary["rendered" if entry["success"] else "failed"] += 1
+
+        def record(future):
+            report_id = pending.pop(future)
+            try:
+                entry = future.result()
+            except Exception as e:
+                # e.g. BrokenProcessPool - record the report as failed and keep the batch going
+                entry = {"id": report_id, "files": {}, "success": False,
+                         "error": f"Worker failed: {type(e).__name__}: {str(e)}"}
+            write_entry(entry)
+
+        pending = {}
+        seen_ids = set()
+        for report_id, medical_text, error in iter_report_inputs(input_path):
+            if error is not None:
+                write_entry({"id": report_id, "files": {}, "success": False, "error": error})
+                continue
+
+            # Repeated ids would render to the same files, so only the first one is kept
+            if str(report_id) in seen_ids:
+                write_entry({"id": report_id, "files": {}, "success": False,
+                             "error": "Duplicate report id - skipped"})
+                continue
+            seen_ids.add(str(report_id))
+
+            try:
+                future = pool.submit(render_one_report, report_id, medical_text, output_dir, formats)
+            except RuntimeError as e:  # BrokenProcessPool, or the pool is shutting down
+                write_entry({"id": report_id, "files": {}, "success": False,
+                             "error": f"Worker failed: {type(e).__name__}: {str(e)}"})
+                continue
+            pending[future] = report_id
+            if len(pending) >= max_pending:
+                record(next(as_completed(pending)))
+
+        for future in as_completed(list(pending)):
+            record(future)
+
+    elapsed = time.perf_counter() - started
+    summary["elapsed_seconds"] = round(elapsed, 2)
+    total = summary["rendered"] + summary["failed"]
+    summary["reports_per_hour"] = int(total / elapsed * 3600) if elapsed > 0 else 0
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Render printable patient reports in bulk")
+    parser.add_argument("input", help="JSONL file of {id, medical_text} records or a directory of .txt reports")
+    parser.add_argument("output_dir", help="Directory for rendered files and manifest.jsonl")
+    parser.add_argument("--formats", nargs="+", choices=SUPPORTED_FORMATS, default=list(SUPPORTED_FORMATS))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    summary = render_batch(args.input, args.output_dir, formats=args.formats, workers=args.workers)
+    print(f"🖨️ Rendered {summary['rendered']} reports ({summary['failed']} failed) in "
+          f"{summary['elapsed_seconds']}s - about {summary['reports_per_hour']} reports/hour")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Streaming cohort statistics for extracted medical values
+Keeps constant-size, mergeable summaries per test and time window without storing reports
+
+Each test in each window holds counts, abnormal rates and a DDSketch (log-bucketed
+quantile sketch with bounded relative error). Sketches merge exactly, so per-worker
+state can be combined by adding bucket counts.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+class DDSketch:
+    """
+    Quantile sketch with relative accuracy guarantees (Masson et al., 2019)
+    Positive values only - extracted medical values are validated to be > 0
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _bucket_index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value):
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            index = self._bucket_index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self._collapse()
+        self.count += 1
+
+    def _collapse(self):
+        # Fold the lowest buckets together so memory stays bounded
+        while len(self.buckets) > self.max_buckets:
+            lowest, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(lowest)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, bucket_count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket_count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self.max_buckets,
+            "buckets": {str(index): bucket_count for index, bucket_count in self.buckets.items()},
+            "zero_count": self.zero_count,
+            "count": self.count
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"], data["max_buckets"])
+        sketch.buckets = {int(index): bucket_count for index, bucket_count in data["buckets"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        return sketch
+
+class TestStatistics:
+    """Counts, abnormal rates and a quantile sketch for one test in one window"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.count = 0
+        self.low_count = 0
+        self.high_count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = DDSketch(relative_accuracy)
+
+    def add(self, value, reference_range=None):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.sketch.add(value)
+
+        if reference_range:
+            if value < reference_range[0]:
+                self.low_count += 1
+            elif value > reference_range[1]:
+                self.high_count += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.low_count += other.low_count
+        self.high_count += other.high_count
+        self.total += other.total
+        for attr, pick in (("minimum", min), ("maximum", max)):
+            theirs = getattr(other, attr)
+            if theirs is not None:
+                ours = getattr(self, attr)
+                setattr(self, attr, theirs if ours is None else pick(ours, theirs))
+        self.sketch.merge(other.sketch)
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "min": self.minimum,
+            "max": self.maximum,
+            "low_rate": round(self.low_count / self.count, 4) if self.count else 0,
+            "high_rate": round(self.high_count / self.count, 4) if self.count else 0,
+            "abnormal_rate": round((self.low_count + self.high_count) / self.count, 4) if self.count else 0,
+            "quantiles": {f"p{round(q * 100, 2):g}": self.sketch.quantile(q) for q in quantiles}
+        }
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "low_count": self.low_count,
+            "high_count": self.high_count,
+            "total": self.total,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "sketch": self.sketch.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data["count"]
+        stats.low_count = data["low_count"]
+        stats.high_count = data["high_count"]
+        stats.total = data["total"]
+        stats.minimum = data["minimum"]
+        stats.maximum = data["maximum"]
+        stats.sketch = DDSketch.from_dict(data["sketch"])
+        return stats
+
+class CohortStatsAggregator:
+    """
+    Per-test statistics over a rolling set of fixed time windows
+    Only the newest max_windows windows are kept, so memory does not grow with traffic
+    """
+
+    def __init__(self, reference_ranges=None, window_seconds=3600, max_windows=24, relative_accuracy=0.01,
+                 logger=None):
+        self.reference_ranges = reference_ranges or {}
+        self.window_seconds = window_seconds
+        self.max_windows = max_windows
+        self.relative_accuracy = relative_accuracy
+        self.logger = logger
+        self.windows = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._flush_timer = None
+        # pid plus a random suffix, so a recycled pid never overwrites a dead worker's file
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _window_start(self, timestamp):
+        return int(timestamp // self.window_seconds) * self.window_seconds
+
+    def _window(self, window_start):
+        if window_start not in self.windows:
+            self.windows[window_start] = {}
+            self.windows = OrderedDict(sorted(self.windows.items()))
+            while len(self.windows) > self.max_windows:
+                self.windows.popitem(last=False)
+        return self.windows.get(window_start)
+
+    def record(self, extracted_values, timestamp=None):
+        """Add the values extracted from one report"""
+        window_start = self._window_start(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            window = self._window(window_start)
+            if window is None:  # Older than every retained window
+                return
+            for test_key, value in extracted_values.items():
+                if test_key not in window:
+                    window[test_key] = TestStatistics(self.relative_accuracy)
+                window[test_key].add(value, self.reference_ranges.get(test_key))
+
+    def merge(self, other):
+        """Fold another aggregator (e.g. another worker's state) into this one"""
+        with self._lock:
+            for window_start, tests in other.windows.items():
+                window = self._window(window_start)
+                if window is None:
+                    continue
+                for test_key, stats in tests.items():
+                    if test_key not in window:
+                        window[test_key] = TestStatistics(self.relative_accuracy)
+                    window[test_key].merge(stats)
+
+    def summary(self, test_key=None, quantiles=DEFAULT_QUANTILES):
+        """JSON-ready statistics per window plus an all-windows total"""
+        with self._lock:
+            windows = []
+            overall = {}
+            for window_start, tests in self.windows.items():
+                window_tests = {}
+                for key, stats in tests.items():
+                    if test_key and key != test_key:
+                        continue
+                    window_tests[key] = stats.summary(quantiles)
+                    if key not in overall:
+                        overall[key] = TestStatistics(self.relative_accuracy)
+                    overall[key].merge(stats)
+                windows.append({
+                    "window_start": window_start,
+                    "window_seconds": self.window_seconds,
+                    "tests": window_tests
+                })
+
+            return {
+                "windows": windows,
+                "overall": {key: stats.summary(quantiles) for key, stats in overall.items()}
+            }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "window_seconds": self.window_seconds,
+                "windows": {
+                    str(window_start): {key: stats.to_dict() for key, stats in tests.items()}
+                    for window_start, tests in self.windows.items()
+                }
+            }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        aggregator = cls(window_seconds=data["window_seconds"], **kwargs)
+        for window_start, tests in data["windows"].items():
+            aggregator.windows[int(window_start)] = {
+                key: TestStatistics.from_dict(stats) for key, stats in tests.items()
+            }
+        aggregator.windows = OrderedDict(sorted(aggregator.windows.items()))
+        return aggregator
+
+    def _stats_file_name(self, worker_id=None):
+        return f"stats-{worker_id or self.worker_id}.json"
+
+    def flush_to_directory(self, directory, worker_id=None):
+        """
+        Write this worker's state to a shared directory for other workers to merge
+        Flushes are serialized and each writes its own temp file, so the published file is always complete
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self._stats_file_name(worker_id))
+        with self._flush_lock:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".stats-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as stats_file:
+                    json.dump(self.to_dict(), stats_file)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return path
+
+    def schedule_flush(self, directory, min_interval_seconds=5, worker_id=None):
+        """
+        Flush to directory from a background timer, at most once per interval
+        A pending timer always picks up records that arrived after the last flush
+        """
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            delay = max(0.0, self._last_flush + min_interval_seconds - time.time())
+            self._flush_timer = threading.Timer(delay, self._timed_flush, args=(directory, worker_id))
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self, directory, worker_id):
+        with self._lock:
+            self._flush_timer = None
+            self._last_flush = time.time()
+        try:
+            self.flush_to_directory(directory, worker_id)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Cohort statistics flush failed: {str(e)}")
+
+    def merged_with_directory(self, directory, worker_id=None):
+        """
+        Return a new aggregator combining this worker's state with every other
+        worker's flushed state in directory
+        Files not written for longer than the retained windows span hold only expired
+        windows (e.g. from recycled workers) and are removed
+        """
+        own_file = self._stats_file_name(worker_id)
+        stale_before = time.time() - self.window_seconds * self.max_windows
+        merged = CohortStatsAggregator(
+            reference_ranges=self.reference_ranges,
+            window_seconds=self.window_seconds,
+            max_windows=self.max_windows,
+            relative_accuracy=self.relative_accuracy
+        )
+        merged.merge(self)
+
+        if directory and os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                if not (file_name.startswith("stats-") and file_name.endswith(".json")) or file_name == own_file:
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    if os.path.getmtime(path) < stale_before:
+                        os.remove(path)
+                        continue
+                    with open(path, encoding="utf-8") as stats_file:
+                        other = CohortStatsAggregator.from_dict(
+                            json.load(stats_file),
+                            max_windows=self.max_windows,
+                            relative_accuracy=self.relative_accuracy
+                        )
+                except (OSError, ValueError, KeyError):
+                    continue
+                merged.merge(other)
+
+        return merged
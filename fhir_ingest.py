@@ -0,0 +1,272 @@
+"""
+Structured FHIR Observation ingestion
+Maps LOINC-coded lab Observations straight to knowledge base keys, skipping regex extraction
+
+Bundles are scanned incrementally: only one entry is held in memory at a time,
+so very large bundles never need to be loaded as a whole JSON tree.
+"""
+import codecs
+import json
+import re
+from datetime import datetime, timezone
+
+LOINC_SYSTEM = "http://loinc.org"
+
+# LOINC code -> MEDICAL_KNOWLEDGE_DATABASE key
+LOINC_CODE_MAP = {
+    "718-7": "hemoglobin",       # Hemoglobin [Mass/volume] in Blood
+    "20509-6": "hemoglobin",     # Hemoglobin [Mass/volume] in Blood by calculation
+    "6690-2": "wbc",             # Leukocytes [#/volume] in Blood by Automated count
+    "26464-8": "wbc",            # Leukocytes [#/volume] in Blood
+    "2345-7": "glucose",         # Glucose [Mass/volume] in Serum or Plasma
+    "2339-0": "glucose",         # Glucose [Mass/volume] in Blood
+    "1558-6": "glucose",         # Fasting glucose [Mass/volume] in Serum or Plasma
+    "2093-3": "cholesterol",     # Cholesterol [Mass/volume] in Serum or Plasma
+    "2571-8": "triglycerides",   # Triglyceride [Mass/volume] in Serum or Plasma
+    "2160-0": "creatinine",      # Creatinine [Mass/volume] in Serum or Plasma
+    "38483-4": "creatinine",     # Creatinine [Mass/volume] in Blood
+    "1742-6": "alt",             # ALT [Enzymatic activity/volume] in Serum or Plasma
+    "1743-4": "alt",             # ALT with P-5'-P
+    "3016-3": "tsh",             # TSH [Units/volume] in Serum or Plasma
+    "11580-8": "tsh"             # TSH [Units/volume] in Serum or Plasma by Detection limit <= 0.005
+}
+
+# Multipliers from common UCUM units to the knowledge base unit of each test
+UNIT_CONVERSIONS = {
+    "hemoglobin": {"g/dl": 1, "g/l": 0.1, "mmol/l": 1.611},
+    "wbc": {"/ul": 1, "cells/ul": 1, "10*3/ul": 1000, "10^3/ul": 1000, "k/ul": 1000, "10*9/l": 1000, "10^9/l": 1000},
+    "glucose": {"mg/dl": 1, "mmol/l": 18.016},
+    "cholesterol": {"mg/dl": 1, "mmol/l": 38.67},
+    "triglycerides": {"mg/dl": 1, "mmol/l": 88.57},
+    "creatinine": {"mg/dl": 1, "umol/l": 1 / 88.42},
+    "alt": {"u/l": 1, "iu/l": 1, "[iu]/l": 1},
+    "tsh": {"miu/l": 1, "m[iu]/l": 1, "uiu/ml": 1, "u[iu]/ml": 1, "mu/l": 1}
+}
+
+def normalize_unit(unit):
+    """Lower-case a unit and fold micro signs so UCUM codes and display units compare equal"""
+    return (unit or "").strip().lower().replace("μ", "u").replace("µ", "u").replace("mcl", "ul")
+
+def build_loinc_unit_index():
+    """Precompute (loinc_code, normalized_unit) -> (test_key, multiplier) lookups"""
+    index = {}
+    for code, test_key in LOINC_CODE_MAP.items():
+        for unit, multiplier in UNIT_CONVERSIONS.get(test_key, {}).items():
+            index[(code, normalize_unit(unit))] = (test_key, multiplier)
+    return index
+
+LOINC_UNIT_INDEX = build_loinc_unit_index()
+
+_JSON_SPECIALS = re.compile(r'[{}\[\]"\\]')
+
+def iter_bundle_entries(stream, chunk_size=65536):
+    """
+    Yield each element of a Bundle's top-level "entry" array as a parsed dict
+    Reads the stream chunk by chunk and only buffers the entry currently being read
+    Raises ValueError when the body is not a complete JSON object with "resourceType": "Bundle"
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    string_parts = None
+    last_top_level_string = None
+    root_resource_type = None
+    root_started = False
+    root_closed = False
+    in_entries = False
+    entry_parts = None
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            # Incremental decoding keeps multi-byte characters split across chunks intact
+            chunk = decoder.decode(chunk)
+            if not chunk:
+                continue
+
+        if not root_started:
+            content = chunk.lstrip()
+            if not content:
+                continue
+            if content[0] != "{":
+                raise ValueError("Request body is not a JSON object")
+            root_started = True
+
+        entry_start = 0 if entry_parts is not None else None
+        string_start = 0 if string_parts is not None else None
+        trailing_start = 0 if root_closed else None
+        position = 0
+
+        if escaped:
+            # The previous chunk ended on a backslash inside a string
+            escaped = False
+            position = 1
+
+        for match in _JSON_SPECIALS.finditer(chunk, position):
+            index = match.start()
+            if index < position:
+                continue
+            char = match.group()
+
+            if in_string:
+                if char == "\\":
+                    if index + 1 >= len(chunk):
+                        escaped = True
+                    position = index + 2
+                elif char == '"':
+                    in_string = False
+                    if string_parts is not None:
+                        string_parts.append(chunk[string_start:index])
+                        top_level_string = "".join(string_parts)
+                        if last_top_level_string == "resourceType" and root_resource_type is None:
+                            root_resource_type = top_level_string
+                        last_top_level_string = top_level_string
+                        string_parts = None
+                        string_start = None
+                continue
+
+            if root_closed:
+                raise ValueError("Unexpected content after the end of the bundle")
+
+            if char == '"':
+                in_string = True
+                if depth == 1:
+                    string_parts = []
+                    string_start = index + 1
+            elif char in "{[":
+                if depth == 1 and char == "[" and last_top_level_string == "entry":
+                    in_entries = True
+                elif in_entries and depth == 2 and char == "{":
+                    entry_parts = []
+                    entry_start = index
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if in_entries and depth == 2 and char == "}" and entry_parts is not None:
+                    entry_parts.append(chunk[entry_start:index + 1])
+                    yield json.loads("".join(entry_parts))
+                    entry_parts = None
+                    entry_start = None
+                elif in_entries and depth == 1:
+                    in_entries = False
+                elif depth == 0:
+                    root_closed = True
+                    trailing_start = index + 1
+                if depth < 0:
+                    raise ValueError("Unbalanced brackets in bundle")
+
+        # Only whitespace may follow the root object - the scan above only looks at structural characters
+        if trailing_start is not None and chunk[trailing_start:].strip():
+            raise ValueError("Unexpected content after the end of the bundle")
+        if entry_parts is not None:
+            entry_parts.append(chunk[entry_start:])
+        if string_parts is not None:
+            string_parts.append(chunk[string_start:])
+
+    # A truncated body must not pass as a smaller, valid bundle
+    decoder.decode(b"", final=True)
+    if not root_started:
+        raise ValueError("Request body is empty")
+    if depth != 0 or in_string or entry_parts is not None or not root_closed:
+        raise ValueError("Bundle ended unexpectedly - the body looks truncated")
+    if root_resource_type != "Bundle":
+        raise ValueError(f"Expected resourceType Bundle, got {root_resource_type or 'none'}")
+
+def observation_to_value(observation):
+    """
+    Map one Observation resource to (test_key, value) in knowledge base units
+    Returns None for Observations we cannot map
+    """
+    quantity = observation.get("valueQuantity")
+    code = observation.get("code") or {}
+    if not isinstance(quantity, dict) or quantity.get("value") is None or not isinstance(code, dict):
+        return None
+    codings = code.get("coding") or []
+    if not isinstance(codings, list):
+        return None
+
+    units = {
+        normalize_unit(unit) for unit in (quantity.get("code"), quantity.get("unit"))
+        if unit is None or isinstance(unit, str)
+    }
+    for coding in codings:
+        if not isinstance(coding, dict) or coding.get("system", LOINC_SYSTEM) != LOINC_SYSTEM:
+            continue
+        for unit in units:
+            mapping = LOINC_UNIT_INDEX.get((coding.get("code"), unit))
+            if mapping:
+                test_key, multiplier = mapping
+                return test_key, round(float(quantity["value"]) * multiplier, 2)
+
+    return None
+
+def parse_fhir_datetime(value):
+    """
+    Parse a FHIR dateTime/instant into an aware UTC datetime for comparisons
+    Partial dates (YYYY, YYYY-MM) and values without an offset are treated as UTC
+    Returns None when missing or unparseable
+    """
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    if len(value) == 4:
+        value += "-01-01"
+    elif len(value) == 7:
+        value += "-01"
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+_OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+def extract_values_from_fhir_bundle(stream, chunk_size=65536):
+    """
+    Stream a FHIR Bundle and collect lab values keyed like extract_medical_values_comprehensive
+    When a test appears more than once the most recent effectiveDateTime wins
+    Returns (extracted_values, stats)
+    """
+    extracted_values = {}
+    effective_times = {}
+    stats = {"entries": 0, "observations": 0, "mapped": 0, "unmapped": 0}
+
+    for entry in iter_bundle_entries(stream, chunk_size):
+        stats["entries"] += 1
+        resource = entry.get("resource") or {}
+        if not isinstance(resource, dict) or resource.get("resourceType") != "Observation":
+            continue
+        stats["observations"] += 1
+
+        if resource.get("status") in ("entered-in-error", "cancelled"):
+            stats["unmapped"] += 1
+            continue
+
+        try:
+            mapped = observation_to_value(resource)
+        except (TypeError, ValueError):
+            mapped = None
+        if mapped is None:
+            stats["unmapped"] += 1
+            continue
+
+        test_key, value = mapped
+        # Same plausibility window as text extraction
+        if not 0.01 <= value <= 50000:
+            stats["unmapped"] += 1
+            continue
+
+        effective = parse_fhir_datetime(resource.get("effectiveDateTime") or resource.get("effectiveInstant")) or _OLDEST
+        if test_key not in extracted_values or effective > effective_times[test_key]:
+            extracted_values[test_key] = value
+            effective_times[test_key] = effective
+        stats["mapped"] += 1
+
+    return extracted_values, stats
@@ -0,0 +1,194 @@
+"""
+Fuzzy test-name matching for OCR-damaged and misspelled reports
+A trigram index narrows candidates before a bounded edit-distance check,
+so lookups only touch terms that share trigrams with the query
+"""
+import re
+from collections import defaultdict
+
+def trigrams(term):
+    """Padded character trigrams of a term"""
+    padded = f"  {term} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def bounded_edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions)
+    Returns max_distance + 1 as soon as the distance is known to exceed the bound
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+def default_max_distance(term_length):
+    """Edit budget by length - very short names must match exactly"""
+    if term_length < 5:
+        return 0
+    if term_length <= 8:
+        return 1
+    return 2
+
+class TrigramIndex:
+    """Inverted index from trigrams to terms, each term carrying a payload"""
+
+    def __init__(self, max_distance=default_max_distance):
+        self.max_distance = max_distance
+        self.terms = []
+        self.payloads = []
+        self.postings = defaultdict(list)
+        self.exact = {}
+
+    def add(self, term, payload):
+        if term in self.exact:
+            return
+        term_id = len(self.terms)
+        self.terms.append(term)
+        self.payloads.append(payload)
+        self.exact[term] = term_id
+        for gram in set(trigrams(term)):
+            self.postings[gram].append(term_id)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, query):
+        """
+        Return (payload, term, distance) for the closest term within the edit budget, or None
+        Each edit can destroy at most three trigrams, which bounds the candidates worth checking
+        """
+        if query in self.exact:
+            term_id = self.exact[query]
+            return self.payloads[term_id], query, 0
+
+        budget = self.max_distance(len(query))
+        if budget == 0:
+            return None
+
+        query_grams = set(trigrams(query))
+        min_shared = len(query_grams) - 3 * budget
+        if min_shared <= 0:
+            return None
+
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for term_id in self.postings.get(gram, ()):
+                shared[term_id] += 1
+
+        best = None
+        for term_id, count in shared.items():
+            if count < min_shared:
+                continue
+            term = self.terms[term_id]
+            term_budget = min(budget, self.max_distance(len(term)))
+            distance = bounded_edit_distance(query, term, term_budget)
+            if distance <= term_budget and (best is None or distance < best[2]):
+                best = (self.payloads[term_id], term, distance)
+
+        return best
+
+# A value is a standalone number: digits inside tokens such as "a1c", "24h", "3rd", "x2"
+# or "glucose-6-phosphate" are part of a name. A unit may follow directly ("13g/dl").
+_NUMBER = re.compile(r'(?<![a-z0-9.])\d+(?:\.\d+)?(?:(?![a-z0-9]|-[a-z])|(?=[a-z]+/))')
+_WORD = re.compile(r'[a-z]+')
+_TOKEN = re.compile(r'[a-z0-9]+')
+# Dates (01/02/2024, 2024-01-02) and ranges (12.0-16.0, 4 to 11) are never test values
+_DATE_OR_RANGE = re.compile(r'\d+(?:\.\d+)?(?:\s*(?:[/\-–]|to)\s*\d+(?:\.\d+)?)+')
+_PARENTHETICAL = re.compile(r'\([^()]*\)')
+# Unit of the previous value on the same line ("... 2.1 mg/dL alt 80")
+_LEADING_UNIT = re.compile(r'^\s*\S*[/%]\S*')
+# Only plain words between two numbers ("2 hr pp: 160", "13 creatinine 2.1")
+_PLAIN_WORDS = re.compile(r'[ \t]*[a-z]+(?:[ \t]+[a-z]+)*[ :=\-–.#]*')
+_NAME_SEPARATORS = re.compile(r'[:;|,\t]')
+_VALUE_SEPARATORS = " :=-–.#"
+# Words that qualify a name without changing the test ("White Blood Cell Count")
+_TRAILING_QUALIFIERS = {"count", "level", "levels", "value", "result"}
+
+def normalize_term(term):
+    """Lower-case and reduce to plain words so index terms and report phrases compare equal"""
+    return " ".join(_WORD.findall(term.lower()))
+
+def _is_single_letter(word):
+    return len(word) == 1 and word.isalpha()
+
+def iter_numeric_contexts(text, max_words=4):
+    """
+    Yield (words, value_text, joined) for every number whose test name sits directly before it
+    Only separators (":", "=", "-", spaces) and parenthetical notes may come between
+    the name and the number. The name is everything after the previous separator
+    such as ":" or ",". Numbers inside dates, ranges, parentheses and alphanumeric
+    tokens are skipped. joined is True when only plain words separate the number
+    from the previous one on the same line, as in "2 hr pp: 160".
+    Expects lower-cased text.
+    """
+    skipped_spans = [match.span() for match in _DATE_OR_RANGE.finditer(text)]
+    window_start = 0
+
+    for match in _NUMBER.finditer(text):
+        if any(start <= match.start() < end for start, end in skipped_spans):
+            continue
+
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        follows_value = window_start > line_start
+        window = text[max(window_start, line_start):match.start()]
+        if window.rfind("(") > window.rfind(")"):
+            continue  # Inside a parenthetical note such as "(fasting 8 hrs)"
+        window_start = match.end()
+        joined = follows_value and _PLAIN_WORDS.fullmatch(window) is not None
+        if follows_value:
+            window = _LEADING_UNIT.sub("", window)
+
+        before_value = _PARENTHETICAL.sub(" ", window).rstrip(_VALUE_SEPARATORS + " ")
+        if not before_value or not before_value[-1].isalnum():
+            yield [], match.group(), joined
+            continue
+
+        words = _TOKEN.findall(_NAME_SEPARATORS.split(before_value)[-1])
+        # Single letters are abbreviations such as "S." for serum
+        while words and _is_single_letter(words[0]):
+            words.pop(0)
+        while words and (_is_single_letter(words[-1]) or (len(words) > 1 and words[-1] in _TRAILING_QUALIFIERS)):
+            words.pop()
+
+        yield (words if len(words) <= max_words else []), match.group(), joined
+
+def fuzzy_match_values(text, index, skip_keys=(), value_range=(0.01, 50000)):
+    """
+    Extract {key: value} from text by fuzzy-matching the full name right before each number
+    A number followed by more words and another value in the same clause belongs to a
+    longer label ("glucose 2 hr pp: 160") unless those words name another test
+    The first value found for a test wins, as in the exact stage
+    """
+    matched = {}
+    pending = None
+
+    for words, value_text, joined in iter_numeric_contexts(text):
+        hit = index.search(" ".join(words)) if words else None
+        if pending is not None and not (joined and hit is None):
+            matched.setdefault(*pending)
+        pending = None
+
+        if hit is None or hit[0] in skip_keys or hit[0] in matched:
+            continue
+
+        value = float(value_text)
+        if value_range[0] <= value <= value_range[1]:
+            pending = (hit[0], value)
+
+    if pending is not None:
+        matched.setdefault(*pending)
+
+    return matched
@@ -0,0 +1,243 @@
+"""
+Background job processing for long-running analyses
+Jobs are queued by priority on a bounded queue and run by a pool of worker threads
+
+The job store is pluggable: anything implementing JobStore can replace the
+in-memory default (e.g. a shared database for multi-process deployments), either
+in code or by naming a factory with load_job_store("package.module:factory").
+"""
+import importlib
+import ipaddress
+import itertools
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from urllib.parse import urlparse
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+class QueueFullError(Exception):
+    """Raised when the bounded job queue cannot accept more work"""
+
+class JobStore(ABC):
+    """Interface for job persistence"""
+
+    @abstractmethod
+    def save(self, job):
+        """Insert or replace a job record"""
+
+    @abstractmethod
+    def get(self, job_id):
+        """Return a copy of the job record, or None"""
+
+    @abstractmethod
+    def delete(self, job_id):
+        """Remove a job record if present"""
+
+    @abstractmethod
+    def expired_ids(self, now):
+        """Return ids of jobs whose expires_at is at or before now"""
+
+class InMemoryJobStore(JobStore):
+    """Default store - keeps jobs in a dict guarded by a lock"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def expired_ids(self, now):
+        with self._lock:
+            return [
+                job_id for job_id, job in self._jobs.items()
+                if job.get("expires_at") is not None and job["expires_at"] <= now
+            ]
+
+def load_job_store(spec=None):
+    """
+    Build the job store named by spec ("package.module:factory"), or the in-memory default
+    The factory is called without arguments and must return a JobStore
+    """
+    if not spec:
+        return InMemoryJobStore()
+
+    module_name, _, factory_name = spec.partition(":")
+    if not module_name or not factory_name:
+        raise ValueError(f"Job store must be given as 'module:factory', got {spec!r}")
+    factory = getattr(importlib.import_module(module_name), factory_name)
+    store = factory()
+    if not isinstance(store, JobStore):
+        raise TypeError(f"{spec} did not return a JobStore")
+    return store
+
+def is_local_url(url):
+    """Only loopback http(s) callbacks are allowed so jobs cannot reach other hosts"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    if parsed.hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(parsed.hostname).is_loopback
+    except ValueError:
+        return False
+
+class _RefuseRedirects(urllib.request.HTTPRedirectHandler):
+    """A redirect could bounce a local callback to another host, so never follow one"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        raise urllib.error.HTTPError(req.full_url, code, f"Callback redirects are not followed: {msg}", headers, fp)
+
+_CALLBACK_OPENER = urllib.request.build_opener(_RefuseRedirects)
+
+class JobQueue:
+    """
+    Priority job queue with a fixed worker pool and result expiry
+    Lower priority numbers run first; equal priorities run in submission order
+    """
+
+    def __init__(self, handler, store=None, workers=2, max_queue_size=100,
+                 result_ttl_seconds=3600, callback_timeout_seconds=5, logger=None):
+        self.handler = handler
+        self.store = store or InMemoryJobStore()
+        self.workers = workers
+        self.result_ttl_seconds = result_ttl_seconds
+        self.callback_timeout_seconds = callback_timeout_seconds
+        self.logger = logger
+        self._queue = queue.PriorityQueue(maxsize=max_queue_size)
+        self._sequence = itertools.count()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start worker threads (idempotent)"""
+        with self._start_lock:
+            if self._started:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def submit(self, payload, priority=5, callback_url=None):
+        """Queue a job and return its record - raises QueueFullError when the queue is at capacity"""
+        if callback_url and not is_local_url(callback_url):
+            raise ValueError("callback_url must point to localhost")
+
+        self.start()
+        self.purge_expired()
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": JOB_QUEUED,
+            "priority": priority,
+            "callback_url": callback_url,
+            "submitted_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": None,
+            "result": None,
+            "error": None
+        }
+        self.store.save(job)
+
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), job["id"], payload))
+        except queue.Full:
+            self.store.delete(job["id"])
+            raise QueueFullError("Job queue is full, please retry later")
+
+        return job
+
+    def get(self, job_id):
+        """Return a job record, or None if unknown or expired"""
+        job = self.store.get(job_id)
+        if job and job["expires_at"] is not None and job["expires_at"] <= time.time():
+            self.store.delete(job_id)
+            return None
+        return job
+
+    def purge_expired(self):
+        for job_id in self.store.expired_ids(time.time()):
+            self.store.delete(job_id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            _, _, job_id, payload = self._queue.get()
+            try:
+                self._run(job_id, payload)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id, payload):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+
+        job["status"] = JOB_RUNNING
+        job["started_at"] = datetime.now().isoformat()
+        self.store.save(job)
+
+        try:
+            job["result"] = self.handler(payload)
+            job["status"] = JOB_SUCCEEDED
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = JOB_FAILED
+            self._log("error", f"Job {job_id} failed: {str(e)}")
+
+        job["finished_at"] = datetime.now().isoformat()
+        job["expires_at"] = time.time() + self.result_ttl_seconds
+        self.store.save(job)
+
+        if job["callback_url"]:
+            self._send_callback(job)
+
+    def _send_callback(self, job):
+        body = json.dumps({
+            "id": job["id"],
+            "status": job["status"],
+            "result": job["result"],
+            "error": job["error"]
+        }).encode("utf-8")
+        callback = urllib.request.Request(
+            job["callback_url"],
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with _CALLBACK_OPENER.open(callback, timeout=self.callback_timeout_seconds):
+                pass
+        except Exception as e:
+            self._log("warning", f"Callback for job {job['id']} failed: {str(e)}")
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
@@ -0,0 +1,231 @@
+"""
+Shadow-mode comparison of extraction engines on live traffic
+The primary engine answers the request; a sampled fraction of requests is replayed
+through a candidate engine in the background and only a privacy-safe diff is kept
+
+Nothing about the candidate run (result, exceptions, slowness) reaches the caller:
+the candidate runs in a separate worker process, so its CPU-bound work never competes
+with request threads for the GIL, and comparisons are dropped when too many are pending.
+Candidate engines must therefore be picklable, i.e. module-level functions.
+"""
+import hashlib
+import json
+import multiprocessing
+import pickle
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cohort_stats import DDSketch
+
+class EngineMetrics:
+    """Comparison counters and latency sketches for one candidate engine"""
+
+    def __init__(self):
+        self.samples = 0
+        self.matches = 0
+        self.mismatches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.delta_total_ms = 0.0
+        self.differing_tests = {}
+        self.primary_latency = DDSketch()
+        self.candidate_latency = DDSketch()
+
+    def summary(self):
+        compared = self.matches + self.mismatches
+        return {
+            "samples": self.samples,
+            "matches": self.matches,
+            "mismatches": self.mismatches,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "match_rate": round(self.matches / compared, 4) if compared else None,
+            "mean_latency_delta_ms": round(self.delta_total_ms / compared, 3) if compared else None,
+            "primary_latency_ms": {f"p{int(q * 100)}": self.primary_latency.quantile(q) for q in (0.5, 0.9, 0.99)},
+            "candidate_latency_ms": {f"p{int(q * 100)}": self.candidate_latency.quantile(q) for q in (0.5, 0.9, 0.99)},
+            "differing_tests": dict(self.differing_tests)
+        }
+
+def _run_timed(engine, text):
+    """Run an engine inside the shadow worker process and time it there, excluding IPC"""
+    started = time.perf_counter()
+    result = engine(text)
+    return result, (time.perf_counter() - started) * 1000
+
+def summarize_difference(primary, candidate, salt=b""):
+    """
+    Describe how two extraction results differ without exposing any values
+    Only test keys and a salted content hash are kept
+    """
+    only_primary = sorted(set(primary) - set(candidate))
+    only_candidate = sorted(set(candidate) - set(primary))
+    changed = sorted(key for key in set(primary) & set(candidate) if primary[key] != candidate[key])
+    digest = hashlib.blake2b(
+        json.dumps([sorted(primary.items()), sorted(candidate.items())]).encode("utf-8"),
+        key=salt,
+        digest_size=8
+    ).hexdigest()
+    return {
+        "missing_in_candidate": only_primary,
+        "extra_in_candidate": only_candidate,
+        "value_changed": changed,
+        "diff_hash": digest
+    }
+
+class ShadowHarness:
+    """
+    Registry of extraction engines plus the shadow comparison loop
+    An engine is any callable taking report text and returning {test_key: value}
+    """
+
+    def __init__(self, primary="comprehensive", candidate=None, sample_rate=0.0,
+                 max_pending=32, recent_diffs=100, salt=None, logger=None):
+        self.engines = {}
+        self.primary = primary
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.logger = logger
+        self.metrics = {}
+        self.recent_diffs = deque(maxlen=recent_diffs)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        # Shared secret salt: diff hashes stay comparable across workers and restarts
+        # but cannot be reversed by guessing lab values
+        self._salt = salt.encode("utf-8") if isinstance(salt, str) else salt
+
+    def validate(self):
+        """
+        Fail fast on a misconfigured harness instead of failing every request
+        Raises ValueError for unknown engines or a shadow setup without a salt
+        """
+        if self.primary not in self.engines:
+            raise ValueError(f"Unknown extraction engine {self.primary!r} - registered: {', '.join(sorted(self.engines))}")
+        if self.candidate is None:
+            return
+        if self.candidate not in self.engines:
+            raise ValueError(f"Unknown shadow engine {self.candidate!r} - registered: {', '.join(sorted(self.engines))}")
+        if not self._salt:
+            raise ValueError("Shadow mode needs a diff hash salt (SHADOW_DIFF_SALT)")
+        if len(self._salt) > hashlib.blake2b.MAX_KEY_SIZE:
+            raise ValueError("Diff hash salt must be at most 64 bytes")
+        try:
+            pickle.dumps(self.engines[self.candidate])
+        except Exception:
+            raise ValueError(f"Shadow engine {self.candidate!r} must be a module-level function to run in a worker process")
+
+    def register(self, name, engine):
+        self.engines[name] = engine
+
+    def extract(self, text, shadow=False):
+        """Run the primary engine and, when sampled, queue the candidate comparison"""
+        started = time.perf_counter()
+        result = self.engines[self.primary](text)
+        primary_ms = (time.perf_counter() - started) * 1000
+
+        if shadow and self._should_sample():
+            self._schedule(text, dict(result), primary_ms)
+
+        return result
+
+    def _should_sample(self):
+        return (
+            self.candidate is not None
+            and self.candidate != self.primary
+            and self.candidate in self.engines
+            and self.sample_rate > 0
+            and random.random() < self.sample_rate
+        )
+
+    def _metrics_for(self, name):
+        if name not in self.metrics:
+            self.metrics[name] = EngineMetrics()
+        return self.metrics[name]
+
+    def _schedule(self, text, primary_result, primary_ms):
+        candidate = self.candidate
+        with self._lock:
+            metrics = self._metrics_for(candidate)
+            if self._pending >= self.max_pending:
+                metrics.dropped += 1
+                return
+            self._pending += 1
+            if self._executor is None:
+                # spawn, not fork: forking a process that already runs request threads is unsafe
+                self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            executor = self._executor
+
+        try:
+            future = executor.submit(_run_timed, self.engines[candidate], text)
+        except RuntimeError:  # BrokenProcessPool, or the executor is shutting down
+            self._discard_executor(executor)
+            with self._lock:
+                self._pending -= 1
+                metrics.errors += 1
+            return
+
+        future.add_done_callback(
+            lambda done: self._compare(candidate, done, executor, primary_result, primary_ms)
+        )
+
+    def _discard_executor(self, executor):
+        """Drop a broken worker pool so the next comparison starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _compare(self, candidate, future, executor, primary_result, primary_ms):
+        try:
+            try:
+                candidate_result, candidate_ms = future.result()
+                error = None
+            except Exception as e:
+                candidate_result, candidate_ms, error = None, None, e
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_executor(executor)
+
+            with self._lock:
+                metrics = self._metrics_for(candidate)
+                metrics.samples += 1
+                if error is not None:
+                    metrics.errors += 1
+                    self._log("warning", f"Shadow engine {candidate} failed: {type(error).__name__}")
+                    return
+
+                metrics.primary_latency.add(primary_ms)
+                metrics.candidate_latency.add(candidate_ms)
+                metrics.delta_total_ms += candidate_ms - primary_ms
+
+                if candidate_result == primary_result:
+                    metrics.matches += 1
+                    return
+
+                metrics.mismatches += 1
+                diff = summarize_difference(primary_result, candidate_result, self._salt)
+                for key in diff["missing_in_candidate"] + diff["extra_in_candidate"] + diff["value_changed"]:
+                    metrics.differing_tests[key] = metrics.differing_tests.get(key, 0) + 1
+                self.recent_diffs.append({"engine": candidate, "recorded_at": time.time(), **diff})
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                "primary": self.primary,
+                "candidate": self.candidate,
+                "sample_rate": self.sample_rate,
+                "engines": sorted(self.engines),
+                "metrics": {name: metrics.summary() for name, metrics in self.metrics.items()},
+                "recent_diffs": list(self.recent_diffs)
+            }
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
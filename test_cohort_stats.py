@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import cohort_stats
+from cohort_stats import CohortStatsAggregator, DDSketch
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("q", [0.5, 0.9, 0.99])
+def test_ddsketch_quantiles_stay_within_relative_accuracy(q):
+    rng = random.Random(7)
+    values = [rng.lognormvariate(4, 1) for _ in range(5000)]
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    expected = exact_quantile(values, q)
+    assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+
+
+def test_ddsketch_merge_matches_a_single_sketch():
+    rng = random.Random(11)
+    values = [rng.uniform(1, 500) for _ in range(2000)]
+    whole, left, right = DDSketch(), DDSketch(), DDSketch()
+    for number, value in enumerate(values):
+        whole.add(value)
+        (left if number % 2 else right).add(value)
+
+    left.merge(right)
+    assert left.buckets == whole.buckets
+    assert left.count == whole.count
+    assert DDSketch.from_dict(json.loads(json.dumps(left.to_dict()))).buckets == whole.buckets
+
+
+def test_ddsketch_refuses_to_merge_different_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.05))
+
+
+def test_test_statistics_merge_counts_abnormal_values():
+    reference = (12.0, 16.0)
+    # Imported through the module so pytest does not collect it as a test class
+    first, second = cohort_stats.TestStatistics(), cohort_stats.TestStatistics()
+    first.add(10.0, reference)
+    second.add(14.0, reference)
+    second.add(18.0, reference)
+
+    first.merge(second)
+    summary = first.summary()
+    assert summary["count"] == 3
+    assert summary["low_rate"] == summary["high_rate"] == round(1 / 3, 4)
+    assert (summary["min"], summary["max"]) == (10.0, 18.0)
+
+
+def test_workers_merge_through_a_shared_directory(tmp_path):
+    now = time.time()
+    first, second = CohortStatsAggregator(), CohortStatsAggregator()
+    first.record({"glucose": 100.0}, timestamp=now)
+    second.record({"glucose": 140.0, "hemoglobin": 13.0}, timestamp=now)
+    second.flush_to_directory(str(tmp_path))
+
+    merged = first.merged_with_directory(str(tmp_path))
+    overall = merged.summary()["overall"]
+    assert overall["glucose"]["count"] == 2
+    assert overall["hemoglobin"]["count"] == 1
+
+
+def test_each_aggregator_writes_its_own_file(tmp_path):
+    first, second = CohortStatsAggregator(), CohortStatsAggregator()
+    # Same process, so the same pid - a recycled pid must not overwrite another worker's file
+    assert first.flush_to_directory(str(tmp_path)) != second.flush_to_directory(str(tmp_path))
+
+
+def test_concurrent_flushes_always_publish_a_complete_file(tmp_path):
+    aggregator = CohortStatsAggregator()
+    aggregator.record({"glucose": 100.0})
+    errors = []
+
+    def flush():
+        try:
+            for _ in range(20):
+                aggregator.flush_to_directory(str(tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=flush) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(os.listdir(tmp_path)) == [f"stats-{aggregator.worker_id}.json"]
+    with open(tmp_path / f"stats-{aggregator.worker_id}.json", encoding="utf-8") as stats_file:
+        assert CohortStatsAggregator.from_dict(json.load(stats_file)).summary()["overall"]["glucose"]["count"] == 1
+
+
+def test_stale_worker_files_are_removed(tmp_path):
+    retired = CohortStatsAggregator(window_seconds=60, max_windows=2)
+    retired.record({"glucose": 100.0})
+    path = retired.flush_to_directory(str(tmp_path))
+    old = time.time() - 3 * 60
+    os.utime(path, (old, old))
+
+    merged = CohortStatsAggregator(window_seconds=60, max_windows=2).merged_with_directory(str(tmp_path))
+    assert "glucose" not in merged.summary()["overall"]
+    assert not os.path.exists(path)
@@ -0,0 +1,133 @@
+import io
+import json
+
+import pytest
+
+from fhir_ingest import extract_values_from_fhir_bundle, iter_bundle_entries, parse_fhir_datetime
+from medical_report_simplifier import app
+
+
+def observation(code, value, unit, effective=None, **extra):
+    resource = {
+        "resourceType": "Observation",
+        "status": "final",
+        "code": {"coding": [{"system": "http://loinc.org", "code": code}]},
+        "valueQuantity": {"value": value, "unit": unit},
+        **extra
+    }
+    if effective:
+        resource["effectiveDateTime"] = effective
+    return {"resource": resource}
+
+
+def bundle(*entries, **fields):
+    # Raw UTF-8, so multi-byte characters really get split across chunks
+    return json.dumps({"resourceType": "Bundle", "type": "searchset", **fields, "entry": list(entries)},
+                      ensure_ascii=False)
+
+
+def read_entries(body, chunk_size):
+    return list(iter_bundle_entries(io.BytesIO(body.encode("utf-8")), chunk_size))
+
+
+TRICKY_ENTRIES = [
+    observation("718-7", 11.2, "g/dL", note='brackets } ] { [ and "quotes" inside a string'),
+    observation("2345-7", 5.5, "mmol/L", note="escaped backslash \\ then quote \" then \\\""),
+    observation("3016-3", 2.5, "µIU/mL", note="multi-byte 血红蛋白 é ✓ 🩸"),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 65536])
+def test_entries_survive_every_chunk_boundary(chunk_size):
+    assert read_entries(bundle(*TRICKY_ENTRIES), chunk_size) == TRICKY_ENTRIES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 65536])
+def test_text_streams_are_read_like_byte_streams(chunk_size):
+    body = bundle(*TRICKY_ENTRIES)
+    assert list(iter_bundle_entries(io.StringIO(body), chunk_size)) == TRICKY_ENTRIES
+
+
+def test_resource_type_may_come_after_the_entries():
+    body = json.dumps({"entry": TRICKY_ENTRIES[:1], "type": "collection", "resourceType": "Bundle"})
+    assert read_entries(body, 4) == TRICKY_ENTRIES[:1]
+
+
+def test_nested_resource_types_do_not_count_as_the_root():
+    body = json.dumps({"entry": TRICKY_ENTRIES[:1]})
+    with pytest.raises(ValueError, match="resourceType"):
+        read_entries(body, 65536)
+
+
+@pytest.mark.parametrize("body", [
+    "",
+    "   ",
+    "garbage",
+    "[]",
+    '{"resourceType": "Patient"}',
+    '{"resourceType": "Bundle"} x',
+    '{"resourceType": "Bundle"} {}',
+    '{"resourceType": "Bundle"}}',
+])
+def test_malformed_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        read_entries(body, 3)
+
+
+@pytest.mark.parametrize("cut", [1, 10, 40, -3, -2, -1])
+def test_truncated_bundles_are_rejected(cut):
+    body = bundle(*TRICKY_ENTRIES)
+    with pytest.raises(ValueError):
+        read_entries(body[:cut], 8)
+
+
+def test_incomplete_multi_byte_character_at_the_end_is_rejected():
+    body = bundle(*TRICKY_ENTRIES).encode("utf-8") + "🩸".encode("utf-8")[:2]
+    with pytest.raises(ValueError):
+        list(iter_bundle_entries(io.BytesIO(body), 4))
+
+
+def test_most_recent_observation_wins_across_offsets():
+    body = bundle(
+        observation("2345-7", 100, "mg/dL", "2024-05-01T10:00:00+00:00"),
+        # Later in absolute time despite the earlier wall-clock hour
+        observation("2345-7", 140, "mg/dL", "2024-05-01T08:00:00-05:00"),
+        observation("2345-7", 90, "mg/dL")
+    )
+    values, stats = extract_values_from_fhir_bundle(io.BytesIO(body.encode("utf-8")))
+    assert values == {"glucose": 140}
+    assert stats["mapped"] == 3
+
+
+@pytest.mark.parametrize("resource_fields", [
+    {"valueQuantity": "11.2 g/dL"},
+    {"valueQuantity": [11.2]},
+    {"code": "718-7"},
+    {"code": {"coding": "718-7"}},
+    {"code": {"coding": ["718-7"]}},
+    {"valueQuantity": {"value": 11.2, "unit": ["g/dL"]}},
+])
+def test_malformed_observation_fields_are_unmapped(resource_fields):
+    entry = observation("718-7", 11.2, "g/dL")
+    entry["resource"].update(resource_fields)
+    values, stats = extract_values_from_fhir_bundle(io.BytesIO(bundle(entry).encode("utf-8")))
+    assert values == {}
+    assert stats["unmapped"] == 1
+
+
+def test_parse_fhir_datetime_handles_partial_dates_and_offsets():
+    assert parse_fhir_datetime("2024") < parse_fhir_datetime("2024-02") < parse_fhir_datetime("2024-02-01T00:00:01Z")
+    assert parse_fhir_datetime("2024-05-01T08:00:00-05:00") > parse_fhir_datetime("2024-05-01T10:00:00Z")
+    assert parse_fhir_datetime("yesterday") is None
+
+
+def test_endpoint_answers_400_for_trailing_text_and_200_for_bad_fields():
+    client = app.test_client()
+    response = client.post("/simplify-fhir", data='{"resourceType":"Bundle"} x')
+    assert response.status_code == 400
+
+    entry = observation("718-7", 11.2, "g/dL")
+    entry["resource"]["valueQuantity"] = "11.2"
+    response = client.post("/simplify-fhir", data=bundle(entry))
+    assert response.status_code == 200
+    assert response.get_json()["fhir_ingestion"]["unmapped"] == 1
@@ -0,0 +1,71 @@
+import pytest
+
+from fuzzy_matching import TrigramIndex, bounded_edit_distance, fuzzy_match_values
+from medical_report_simplifier import extract_medical_values_comprehensive, get_fuzzy_alias_index
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Haemoglobln: 11.2 g/dL", {"hemoglobin": 11.2}),
+    ("Tri glycerides: 195 mg/dL", {"triglycerides": 195.0}),
+    ("S. Creatinine: 1.4 mg/dL", {"creatinine": 1.4}),
+    ("Hemoglobin: 10.5 g/dL", {"hemoglobin": 10.5}),
+    ("White Blood Cell Count: 12500 cells/μL", {"wbc": 12500.0}),
+    ("Glucose (Fasting): 156 mg/dL", {"glucose": 156.0}),
+    ("hb 13 creatinine 2.1 mg/dL alt 80", {"hemoglobin": 13.0, "creatinine": 2.1, "alt": 80.0}),
+])
+def test_misspelled_and_bare_names_are_matched(text, expected):
+    assert extract_medical_values_comprehensive(text) == expected
+
+
+@pytest.mark.parametrize("text, test_key, allowed", [
+    # Numbers inside dates must not be read as the value
+    ("Glucose (01/02/2024): 110 mg/dL", "glucose", {110.0}),
+    # Names separated from the number by other words are different tests
+    ("Glucose tolerance test 2 hr 140", "glucose", set()),
+    ("Creatinine clearance 95 mL/min", "creatinine", set()),
+    ("Urine creatinine 120", "creatinine", set()),
+    ("TSH receptor antibody 1.5", "tsh", set()),
+    # Reference ranges are not results
+    ("Hemoglobin 12.0 - 16.0", "hemoglobin", set()),
+])
+def test_values_not_next_to_the_name_are_ignored(text, test_key, allowed):
+    extracted = extract_medical_values_comprehensive(text)
+    if allowed:
+        assert extracted.get(test_key) in allowed
+    else:
+        assert test_key not in extracted
+
+
+
+@pytest.mark.parametrize("text, test_key", [
+    # Digits inside alphanumeric tokens belong to the name, not the value
+    ("Hemoglobin A1c: 6.5 %", "hemoglobin"),
+    ("Glucose-6-phosphate dehydrogenase 10", "glucose"),
+    ("Creatinine 24h urine: 1.2", "creatinine"),
+    ("TSH 3rd gen: 2.1", "tsh"),
+    ("Cholesterol x2 240", "cholesterol"),
+    # A number followed by more label words and a value is part of the label
+    ("Glucose 2 hr PP: 160", "glucose"),
+])
+def test_numbers_inside_longer_names_are_not_values(text, test_key):
+    assert test_key not in extract_medical_values_comprehensive(text)
+
+
+def test_trailing_single_letters_and_attached_units():
+    assert extract_medical_values_comprehensive("Hemoglobin A: 12.5") == {"hemoglobin": 12.5}
+    assert extract_medical_values_comprehensive("Hemoglobin 13g/dL") == {"hemoglobin": 13.0}
+
+def test_exact_stage_values_are_not_overridden():
+    index = get_fuzzy_alias_index()
+    assert fuzzy_match_values("haemoglobln: 9", index, skip_keys={"hemoglobin": 11.0}) == {}
+
+
+def test_trigram_index_respects_edit_budget():
+    index = TrigramIndex()
+    index.add("creatinine", "creatinine")
+    index.add("alt", "alt")
+
+    assert index.search("creatinlne")[0] == "creatinine"
+    # Short names must match exactly
+    assert index.search("ast") is None
+    assert bounded_edit_distance("triglycerides", "tri glycerides", 2) == 1
@@ -0,0 +1,159 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import medical_report_simplifier
+from job_queue import (
+    JOB_SUCCEEDED, InMemoryJobStore, JobQueue, JobStore, QueueFullError, load_job_store
+)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.messages = []
+
+    def warning(self, message):
+        self.messages.append(message)
+
+    error = warning
+
+
+def blocked_queue(**kwargs):
+    """A single-worker queue whose first job holds the worker until released"""
+    release = threading.Event()
+    order = []
+
+    def handler(payload):
+        if payload == "blocker":
+            release.wait(5)
+        order.append(payload)
+        return payload
+
+    jobs = JobQueue(handler, workers=1, **kwargs)
+    blocker = jobs.submit("blocker", priority=0)
+    assert wait_for(lambda: jobs.get(blocker["id"])["status"] != "queued")
+    return jobs, release, order
+
+
+def test_lower_priority_numbers_run_first_and_ties_keep_submission_order():
+    jobs, release, order = blocked_queue()
+    for payload, priority in [("low", 9), ("first-normal", 5), ("urgent", 0), ("second-normal", 5)]:
+        jobs.submit(payload, priority=priority)
+
+    release.set()
+    assert wait_for(lambda: len(order) == 5)
+    assert order == ["blocker", "urgent", "first-normal", "second-normal", "low"]
+
+
+def test_full_queue_raises_and_forgets_the_job():
+    jobs, release, _ = blocked_queue(max_queue_size=1)
+    jobs.submit("waiting")
+    with pytest.raises(QueueFullError):
+        jobs.submit("overflow")
+    release.set()
+
+
+def test_full_queue_answers_503(monkeypatch):
+    jobs, release, _ = blocked_queue(max_queue_size=1)
+    jobs.submit("waiting")
+    monkeypatch.setattr(medical_report_simplifier, "JOB_QUEUE", jobs)
+
+    response = medical_report_simplifier.app.test_client().post("/jobs", json={"medical_text": "Hemoglobin: 12"})
+    release.set()
+    assert response.status_code == 503
+
+
+def test_finished_results_expire_after_their_ttl():
+    jobs = JobQueue(lambda payload: payload, workers=1, result_ttl_seconds=0.2)
+    job = jobs.submit("done")
+    assert wait_for(lambda: (jobs.get(job["id"]) or {}).get("status") == JOB_SUCCEEDED)
+
+    time.sleep(0.3)
+    assert jobs.get(job["id"]) is None
+    assert jobs.store.get(job["id"]) is None
+
+
+@pytest.mark.parametrize("url", [
+    "http://example.com/hook",
+    "http://10.0.0.5/hook",
+    "ftp://localhost/hook",
+    "http://localhost.example.com/hook",
+])
+def test_non_local_callbacks_are_refused(url):
+    jobs = JobQueue(lambda payload: payload, workers=1)
+    with pytest.raises(ValueError):
+        jobs.submit("payload", callback_url=url)
+
+
+class _Recorder(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.hits.append(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.redirect_to:
+            self.send_response(307)
+            self.send_header("Location", self.server.redirect_to)
+        else:
+            self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(redirect_to=None):
+    server = HTTPServer(("127.0.0.1", 0), _Recorder)
+    server.hits = []
+    server.redirect_to = redirect_to
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_callbacks_never_follow_redirects():
+    target = start_server()
+    redirector = start_server(redirect_to=f"http://127.0.0.1:{target.server_port}/stolen")
+    logger = RecordingLogger()
+    try:
+        jobs = JobQueue(lambda payload: payload, workers=1, logger=logger)
+        jobs.submit("payload", callback_url=f"http://127.0.0.1:{redirector.server_port}/hook")
+
+        assert wait_for(lambda: logger.messages)
+        assert redirector.hits == ["/hook"]
+        assert target.hits == []
+        assert "redirect" in logger.messages[0]
+    finally:
+        target.shutdown()
+        redirector.shutdown()
+
+
+def test_local_callbacks_are_delivered():
+    receiver = start_server()
+    try:
+        jobs = JobQueue(lambda payload: payload, workers=1)
+        jobs.submit("payload", callback_url=f"http://localhost:{receiver.server_port}/hook")
+        assert wait_for(lambda: receiver.hits == ["/hook"])
+    finally:
+        receiver.shutdown()
+
+
+def make_store():
+    return InMemoryJobStore()
+
+
+def test_job_store_is_loaded_from_configuration():
+    assert isinstance(load_job_store(None), InMemoryJobStore)
+    assert isinstance(load_job_store("test_job_queue:make_store"), JobStore)
+    with pytest.raises(ValueError):
+        load_job_store("test_job_queue")
+    with pytest.raises(TypeError):
+        load_job_store("test_job_queue:RecordingLogger")
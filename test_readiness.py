@@ -0,0 +1,21 @@
+import medical_report_simplifier
+from medical_report_simplifier import app, warm_up
+
+
+def test_ready_reports_503_until_warm_up_succeeds(monkeypatch):
+    def broken_index():
+        raise RuntimeError("index build failed")
+
+    client = app.test_client()
+    monkeypatch.setattr(medical_report_simplifier, "get_extraction_index", broken_index)
+    warm_up()
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "index build failed"
+
+    monkeypatch.undo()
+    warm_up()
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["ready"] is True
+    assert {"index_build", "sample_analysis", "flask_import", "module_load"} <= set(response.get_json()["timings_ms"])
@@ -0,0 +1,93 @@
+import os
+import time
+
+import pytest
+
+from shadow_mode import ShadowHarness, summarize_difference
+
+
+def primary_engine(text):
+    return {"glucose": 100.0, "pid": float(os.getpid())}
+
+
+def failing_engine(text):
+    raise RuntimeError("candidate bug")
+
+
+def slow_engine(text):
+    time.sleep(0.5)
+    return {"glucose": 100.0}
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def harness(candidate, max_pending=32):
+    shadow = ShadowHarness(primary="primary", candidate=candidate, sample_rate=1.0,
+                           max_pending=max_pending, salt="test-salt")
+    shadow.register("primary", primary_engine)
+    shadow.register("failing", failing_engine)
+    shadow.register("slow", slow_engine)
+    shadow.register("same", primary_engine)
+    shadow.validate()
+    return shadow
+
+
+def test_candidate_runs_in_another_process():
+    shadow = harness("same")
+    assert shadow.extract("report", shadow=True) == primary_engine("report")
+
+    assert wait_for(lambda: shadow.summary()["metrics"]["same"]["samples"] == 1)
+    metrics = shadow.summary()["metrics"]["same"]
+    # Same engine, so only the worker's pid can differ
+    assert metrics["mismatches"] == 1
+    assert metrics["differing_tests"] == {"pid": 1}
+
+
+def test_candidate_exceptions_never_reach_the_caller():
+    shadow = harness("failing")
+    assert shadow.extract("report", shadow=True) == primary_engine("report")
+
+    assert wait_for(lambda: shadow.summary()["metrics"]["failing"]["errors"] == 1)
+    assert shadow.summary()["recent_diffs"] == []
+
+
+def test_full_pending_queue_drops_comparisons_without_waiting():
+    shadow = harness("slow", max_pending=1)
+    started = time.perf_counter()
+    for _ in range(3):
+        assert shadow.extract("report", shadow=True) == primary_engine("report")
+    assert time.perf_counter() - started < 0.4
+
+    assert shadow.summary()["metrics"]["slow"]["dropped"] == 2
+    assert wait_for(lambda: shadow.summary()["metrics"]["slow"]["samples"] == 1)
+
+
+@pytest.mark.parametrize("candidate, salt, message", [
+    ("missing", "salt", "Unknown shadow engine"),
+    ("same", None, "salt"),
+    ("same", "x" * 65, "64 bytes"),
+    ("lambda", "salt", "module-level"),
+])
+def test_misconfigured_shadow_mode_is_refused(candidate, salt, message):
+    shadow = ShadowHarness(primary="primary", candidate=candidate, salt=salt)
+    shadow.register("primary", primary_engine)
+    shadow.register("same", primary_engine)
+    shadow.register("lambda", lambda text: {})
+    with pytest.raises(ValueError, match=message):
+        shadow.validate()
+
+
+def test_diff_keeps_keys_and_a_salted_hash_only():
+    diff = summarize_difference({"glucose": 100.0, "tsh": 2.0}, {"glucose": 120.0, "alt": 40.0}, b"salt")
+    assert diff["missing_in_candidate"] == ["tsh"]
+    assert diff["extra_in_candidate"] == ["alt"]
+    assert diff["value_changed"] == ["glucose"]
+    other_salt = summarize_difference({"glucose": 100.0, "tsh": 2.0}, {"glucose": 120.0, "alt": 40.0}, b"other")
+    assert diff["diff_hash"] != other_salt["diff_hash"]